@@ -2,21 +2,60 @@ import os
 import re
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
 import argparse
 
 # --- Configuration ---
 FILE_PATH = "../data/raw/US_Accidents_March23.csv"
 OUT_DIR = "../data/processed"
 
+# Raw columns used downstream (plus the extra ones that identify duplicates).
+# Types are pinned because a dataset scan infers them from the first block
+# only; both time columns stay text since they mix fractional seconds.
+USE_COL_TYPES = {
+    "ID": pa.string(),
+    "Start_Time": pa.string(),
+    "End_Time": pa.string(),
+    "Start_Lat": pa.float64(),
+    "Start_Lng": pa.float64(),
+    "Severity": pa.int64(),
+    "City": pa.string(),
+    "State": pa.string(),
+    "Street": pa.string(),
+    "Traffic_Signal": pa.bool_(),
+    "Weather_Condition": pa.string(),
+    "Temperature(F)": pa.float64(),
+    "Visibility(mi)": pa.float64(),
+    "Precipitation(in)": pa.float64(),
+    "Wind_Speed(mph)": pa.float64(),
+    "Humidity(%)": pa.float64(),
+    "Pressure(in)": pa.float64(),
+    "Sunrise_Sunset": pa.string(),
+    "Distance(mi)": pa.float64(),
+}
+USE_COLS = list(USE_COL_TYPES)
+
+# Columns that together identify a duplicated accident report. This key is
+# narrower than the audit notebook's (every column except ID), so it also
+# drops re-reports that differ only outside it (e.g. weather readings)
+DEDUP_COLS = [
+    "Start_Time", "End_Time", "Start_Lat", "Start_Lng", "Street", "City",
+    "State", "Severity"
+]
+
 # --- Regular Expressions for Road Classification ---
 RE_INTERSTATE = re.compile(r"\bi-\s?\d+\b", re.IGNORECASE)
 RE_US_ROUTE = re.compile(r"\bus\s?-?\s?\d+\b|\bus route\b", re.IGNORECASE)
 RE_STATE_ROUTE_GENERIC = re.compile(
-    r"\b(state route|route)\s?\d+\b", re.IGNORECASE
+    r"\b(?:state route|route)\s?\d+\b", re.IGNORECASE
 )
 RE_STATE_CODE_ROUTE = re.compile(
     r"\b[a-z]{1,3}\s?-?\s?\d+\b", re.IGNORECASE
 )
+# Street directions such as "W 11th St" look like state-coded routes
+RE_DIRECTIONAL_STREET = re.compile(r"\b(?:[nesw]\s?\d+)(?:st|nd|rd|th)\b")
 
 # --- Keywords for Road Classification ---
 KEYWORD_MAP = {
@@ -42,55 +81,53 @@ KEYWORD_MAP = {
     ]
 }
 
+# Structures carrying any of these are High_Speed rather than Medium_Speed
+HIGH_SPEED_STRUCTURES = ["tpke", "turnpike", "freeway", "fwy"]
 
-def map_speed_class(street: str) -> str:
-    """Map street name to a coarse road speed class."""
-    if pd.isna(street) or not str(street).strip():
-        return "Other/Unknown"
-
-    s = str(street).lower().strip()
-
-    # Priority 1: Interstates (High Speed)
-    if RE_INTERSTATE.search(s):
-        return "High_Speed"
+# One compiled alternation per keyword bucket (plain substring matching)
+KEYWORD_RE = {
+    cls: re.compile("|".join(map(re.escape, keywords)))
+    for cls, keywords in KEYWORD_MAP.items()
+}
+RE_HIGH_SPEED_STRUCTURE = re.compile("|".join(HIGH_SPEED_STRUCTURES))
 
-    # Priority 2: High Speed Keywords
-    if any(k in s for k in KEYWORD_MAP["High_Speed"]):
-        return "High_Speed"
 
-    # Priority 3: Structures (Bridges/Tunnels)
-    if any(k in s for k in KEYWORD_MAP["Structure"]):
-        # Special logic: structures with high-speed keywords are High_Speed
-        high_speed_structures = [
-            "tpke", "turnpike", "freeway", "fwy"
-        ]
-        if any(k in s for k in high_speed_structures):
-            return "High_Speed"
-        return "Medium_Speed"
+def classify_speed(streets: pd.Series) -> np.ndarray:
+    """Map street names to a coarse road speed class."""
+    s = streets.fillna("").astype(str).str.lower().str.strip()
 
-    # Priority 4: Defined Routes (Medium Speed)
-    if RE_US_ROUTE.search(s) or RE_STATE_ROUTE_GENERIC.search(s):
-        return "Medium_Speed"
+    def has(pattern: re.Pattern) -> np.ndarray:
+        return s.str.contains(pattern).to_numpy(dtype=bool)
 
-    # State-coded routes with guard against street directions (e.g., "W 11th St")
-    if RE_STATE_CODE_ROUTE.search(s):
-        if not re.search(r"\b([nesw]\s?\d+)(st|nd|rd|th)\b", s):
-            return "Medium_Speed"
+    is_struct = has(KEYWORD_RE["Structure"])
+    is_code_route = has(RE_STATE_CODE_ROUTE) & ~has(RE_DIRECTIONAL_STREET)
 
-    # Priority 5: Medium Speed Keywords
-    if any(k in s for k in KEYWORD_MAP["Medium_Speed"]):
-        return "Medium_Speed"
+    # Checked in priority order: interstates and high-speed keywords,
+    # structures (bridges/tunnels), defined routes, then medium and low
+    # speed keywords; the first matching condition wins
+    conditions = [
+        has(RE_INTERSTATE) | has(KEYWORD_RE["High_Speed"]),
+        is_struct & has(RE_HIGH_SPEED_STRUCTURE),
+        is_struct,
+        has(RE_US_ROUTE) | has(RE_STATE_ROUTE_GENERIC) | is_code_route,
+        has(KEYWORD_RE["Medium_Speed"]),
+        has(KEYWORD_RE["Low_Speed"]),
+    ]
+    choices = [
+        "High_Speed", "High_Speed", "Medium_Speed",
+        "Medium_Speed", "Medium_Speed", "Low_Speed",
+    ]
+    return np.select(conditions, choices, default="Other/Unknown").astype(object)
 
-    # Priority 6: Low Speed Keywords
-    if any(k in s for k in KEYWORD_MAP["Low_Speed"]):
-        return "Low_Speed"
 
-    return "Other/Unknown"
+def collapse_severity(sev: pd.Series) -> np.ndarray:
+    """Collapse 4-level severity into Low/High."""
+    return np.where(sev.isin([1, 2]), "Low", "High").astype(object)
 
 
-def collapse_severity(sev: int) -> str:
-    """Collapse 4-level severity into Low/High."""
-    return "Low" if sev in (1, 2) else "High"
+# --- Cyclical Hour Encoding (index = hour of day) ---
+HOUR_SIN = np.sin(2 * np.pi * np.arange(24) / 24)
+HOUR_COS = np.cos(2 * np.pi * np.arange(24) / 24)
 
 
 def bucket_precipitation(s: pd.Series) -> pd.Categorical:
@@ -128,6 +165,43 @@ def group_weather(cond: str) -> str:
     return "Other"
 
 
+def combine_city_state(city: pd.Series, state: pd.Series) -> pd.Categorical:
+    """Build "City, ST" labels as a categorical without per-row string joins."""
+    city = city.fillna("Unknown").astype("category")
+    state = state.fillna("NA").astype("category")
+
+    # Encode each (city, state) pair as one integer, then label unique pairs only
+    n_states = len(state.cat.categories)
+    pair_codes = (
+        city.cat.codes.to_numpy(dtype=np.int64) * n_states
+        + state.cat.codes.to_numpy(dtype=np.int64)
+    )
+    codes, pairs = pd.factorize(pair_codes)
+    labels = [
+        f"{city.cat.categories[p // n_states]}, {state.cat.categories[p % n_states]}"
+        for p in pairs
+    ]
+    return pd.Categorical.from_codes(codes, categories=labels)
+
+
+def load_raw(year_range: tuple) -> pd.DataFrame:
+    """Load USE_COLS for accidents starting within the given years."""
+    # The scan projects USE_COLS, so other raw columns are never converted.
+    # Start_Time is text, so the year filter is a plain string comparison.
+    # Empty strings become nulls, as in pd.read_csv
+    csv_format = ds.CsvFileFormat(
+        convert_options=pacsv.ConvertOptions(
+            column_types=USE_COL_TYPES,
+            strings_can_be_null=True,
+        )
+    )
+    start = ds.field("Start_Time")
+    in_years = (start >= str(year_range[0])) & (start < str(year_range[1] + 1))
+
+    dataset = ds.dataset(FILE_PATH, format=csv_format)
+    return dataset.to_table(columns=USE_COLS, filter=in_years).to_pandas()
+
+
 def preprocess(post: bool=False, boston: bool=False):
     """Load, clean, and feature-engineer the dataset."""
     if post:
@@ -140,15 +214,13 @@ def preprocess(post: bool=False, boston: bool=False):
     os.makedirs(OUT_DIR, exist_ok=True)
 
     print(f"Loading data from {FILE_PATH}...")
-    df = pd.read_csv(FILE_PATH)
-
-    # --- Deduplication ---
-    # Drop duplicates, ignoring the unique identifier "ID"
-    dup_cols = [c for c in df.columns if c != "ID"]
-    df = df.drop_duplicates(subset=dup_cols)
+    df = load_raw(year_range)
 
     # --- Time Processing ---
-    df["Start_Time"] = pd.to_datetime(df["Start_Time"], errors="coerce")
+    # Explicit ISO8601 keeps the fast C parser and accepts fractional seconds
+    df["Start_Time"] = pd.to_datetime(
+        df["Start_Time"], format="ISO8601", errors="coerce", cache=True
+    )
     df = df.dropna(subset=["Start_Time"])
 
     df["Year"] = df["Start_Time"].dt.year
@@ -158,6 +230,16 @@ def preprocess(post: bool=False, boston: bool=False):
     # Restrict to stable data period
     df = df[df["Year"].between(year_range[0], year_range[1])]
 
+    # Narrow to Boston up front so every later step runs on its rows only
+    if boston:
+        df = df[(df["City"] == "Boston") & (df["State"] == "MA")]
+
+    # --- Deduplication ---
+    # Hash the report key once per row and keep the first of each hash
+    dup_cols = [c for c in DEDUP_COLS if c in df.columns]
+    row_hash = pd.util.hash_pandas_object(df[dup_cols], index=False)
+    df = df[~row_hash.duplicated().to_numpy()]
+
     # --- Data Cleaning ---
     # Physical plausibility filters
     numeric_cols_ranges = {
@@ -166,11 +248,14 @@ def preprocess(post: bool=False, boston: bool=False):
         "Precipitation(in)": (0, 25),
     }
 
+    # Combine all range checks into one mask so the frame is sliced once
+    is_valid = np.ones(len(df), dtype=bool)
     for col, (lo, hi) in numeric_cols_ranges.items():
         if col in df.columns:
             # Keep rows within range OR rows that are already NaN
-            is_valid = df[col].isna() | df[col].between(lo, hi)
-            df = df[is_valid]
+            v = df[col].to_numpy(dtype=float)
+            is_valid &= np.isnan(v) | ((v >= lo) & (v <= hi))
+    df = df[is_valid]
 
     # Impute missing precipitation: no record -> 0.0 in
     df["Precipitation(in)"] = df["Precipitation(in)"].fillna(0.0)
@@ -178,27 +263,21 @@ def preprocess(post: bool=False, boston: bool=False):
     # --- Feature Engineering ---
 
     # Create CityState identifier for grouping/splitting
-    df["CityState"] = (
-        df["City"].fillna("Unknown").astype(str) +
-        ", " +
-        df["State"].fillna("NA").astype(str)
-    )
-
-    if boston:
-        df = df[df["CityState"] == "Boston, MA"]
+    df["CityState"] = combine_city_state(df["City"], df["State"])
 
     # Derived speed class from Street name
     if "Street" in df.columns:
-        df["Speed_Class"] = df["Street"].apply(map_speed_class).astype("object")
+        df["Speed_Class"] = pd.Categorical(classify_speed(df["Street"]))
     else:
-        df["Speed_Class"] = "Unknown"
+        df["Speed_Class"] = pd.Categorical(["Unknown"] * len(df))
 
     # Cyclical encoding for Hour
-    df["Hour_Sin"] = np.sin(2 * np.pi * df["Hour"] / 24)
-    df["Hour_Cos"] = np.cos(2 * np.pi * df["Hour"] / 24)
+    hour = df["Hour"].to_numpy()
+    df["Hour_Sin"] = np.take(HOUR_SIN, hour)
+    df["Hour_Cos"] = np.take(HOUR_COS, hour)
 
     # --- Target Preparation ---
-    df["Severity2"] = df["Severity"].apply(collapse_severity)
+    df["Severity2"] = pd.Categorical(collapse_severity(df["Severity"]))
 
     # --- Final Formatting and Export ---
     features = [
@@ -216,7 +295,8 @@ def preprocess(post: bool=False, boston: bool=False):
     df = df.dropna(subset=[c for c in must_have if c in df.columns])
 
     print(f"Saving processed data to {OUT_FILE}...")
-    df.to_csv(OUT_FILE, index=False)
+    # Arrow's CSV writer encodes in parallel; the notebooks still read CSV
+    pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), OUT_FILE)
     print(f"Done. Rows: {len(df):,}, Columns: {df.shape[1]}")
 
 